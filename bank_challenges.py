@@ -1,4 +1,9 @@
-from typing import TypedDict
+from array import array
+from time import monotonic
+from typing import TYPE_CHECKING, TypedDict
+
+if TYPE_CHECKING:
+    from change_events import ChangeStream
 
 
 class AccountData(TypedDict):
@@ -22,11 +27,132 @@ account_dataset: list[AccountData] = [
 ]
 
 
+HISTORY_DEPTH = 10
+
+# Set by ChangeStream.attach; while it is None, mutations emit no events.
+change_stream: "ChangeStream | None" = None
+
+
+class TransactionJournal:
+    def __init__(self, depth: int = HISTORY_DEPTH):
+        if not 0 < depth < 256:
+            raise ValueError("A journal must keep between 1 and 255 transactions.")
+        self.depth = depth
+        # Every account gets a block of `depth` slots in these shared arrays
+        # when it makes its first transaction, and gives it back when it is
+        # discarded, so history memory is bounded by the number of live
+        # accounts times the depth.
+        self.amounts = array("d")
+        self.next_slots = array("B")
+        self.lengths = array("B")
+        self.free_blocks = array("q")
+        self.empty_block = array("d", [0.0]) * depth
+
+    def open_block(self) -> int:
+        if self.free_blocks:
+            block = self.free_blocks.pop()
+            self.next_slots[block] = 0
+            self.lengths[block] = 0
+            return block
+        self.amounts.extend(self.empty_block)
+        self.next_slots.append(0)
+        self.lengths.append(0)
+        return len(self.lengths) - 1
+
+    def close_block(self, block: int) -> None:
+        self.free_blocks.append(block)
+
+    def block_count(self) -> int:
+        return len(self.lengths) - len(self.free_blocks)
+
+    def record(self, block: int, amount: float) -> None:
+        next_slot = self.next_slots[block]
+        self.amounts[block * self.depth + next_slot] = amount
+        self.next_slots[block] = (next_slot + 1) % self.depth
+        if self.lengths[block] < self.depth:
+            self.lengths[block] += 1
+
+    def history(self, block: int, limit: int) -> list[float]:
+        if block < 0:
+            return []
+        start = block * self.depth
+        next_slot = self.next_slots[block]
+        return [
+            self.amounts[start + (next_slot - i) % self.depth]
+            for i in range(1, min(limit, self.lengths[block]) + 1)
+        ]
+
+    def last(self, block: int) -> float | None:
+        if block < 0 or not self.lengths[block]:
+            return None
+        return self.amounts[
+            block * self.depth + (self.next_slots[block] - 1) % self.depth
+        ]
+
+    def pop(self, block: int) -> None:
+        self.next_slots[block] = (self.next_slots[block] - 1) % self.depth
+        self.lengths[block] -= 1
+
+
+transaction_journal = TransactionJournal()
+
+SECONDS_PER_DAY = 24 * 60 * 60
+DAILY_WITHDRAWAL_LIMIT = 500
+TERMINAL_WITHDRAWALS_PER_MINUTE = 30
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "refill_per_second", "tokens", "refilled_at")
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.refilled_at = monotonic()
+
+    def try_consume(self, amount: float) -> bool:
+        # Refill lazily from the time elapsed since the last check, so idle
+        # buckets cost nothing.
+        now = monotonic()
+        tokens = self.tokens + (now - self.refilled_at) * self.refill_per_second
+        self.tokens = tokens if tokens < self.capacity else self.capacity
+        self.refilled_at = now
+        if amount > self.tokens:
+            return False
+        self.tokens -= amount
+        return True
+
+
 class BankAccount:
-    def __init__(self, account_number: str, customer_name: str, balance: float):
+    __slots__ = (
+        "account_number",
+        "customer_name",
+        "balance",
+        "journal",
+        "journal_block",
+        "withdrawal_allowance",
+        "allowance_refilled_at",
+    )
+    # Shared by every account, so the limit costs each account two floats.
+    daily_withdrawal_limit: float = DAILY_WITHDRAWAL_LIMIT
+    withdrawal_refill_per_second: float = DAILY_WITHDRAWAL_LIMIT / SECONDS_PER_DAY
+
+    def __init__(
+        self,
+        account_number: str,
+        customer_name: str,
+        balance: float,
+        journal: TransactionJournal | None = None,
+    ):
         self.account_number = account_number
         self.customer_name = customer_name
         self.balance = balance
+        self.journal = transaction_journal if journal is None else journal
+        self.journal_block = -1
+        # The daily limit is a token bucket kept inline: the remaining allowance
+        # and when it was last refilled are the only per-account state.
+        self.withdrawal_allowance = self.daily_withdrawal_limit
+        self.allowance_refilled_at = 0.0
 
     @classmethod
     def from_account_data(cls, account_data: AccountData):
@@ -37,15 +163,75 @@ class BankAccount:
         )
 
     def deposit(self, amount: float) -> None:
-        pass
+        if amount <= 0:
+            raise ValueError("We only accept deposits of positive amounts.")
+        self.balance += amount
+        self.record_transaction(amount)
+        if change_stream is not None:
+            change_stream.emit(("deposit", self.account_number, amount))
 
     def withdraw(self, amount: float) -> None:
-        pass
+        if amount <= 0:
+            raise ValueError("We only accept withdrawals of positive amounts.")
+        if amount > self.balance:
+            raise ValueError("You cannot withdraw more than you have in your account.")
+        now = monotonic()
+        limit = self.daily_withdrawal_limit
+        allowance = (
+            self.withdrawal_allowance
+            + (now - self.allowance_refilled_at) * self.withdrawal_refill_per_second
+        )
+        if allowance > limit:
+            allowance = limit
+        if amount > allowance:
+            raise ValueError("You cannot withdraw more than your daily limit allows.")
+        self.withdrawal_allowance = allowance - amount
+        self.allowance_refilled_at = now
+        self.balance -= amount
+        self.record_transaction(-amount)
+        if change_stream is not None:
+            change_stream.emit(("withdraw", self.account_number, -amount))
+
+    def __del__(self) -> None:
+        if self.journal_block >= 0:
+            self.journal.close_block(self.journal_block)
+
+    def record_transaction(self, amount: float) -> None:
+        if self.journal_block < 0:
+            self.journal_block = self.journal.open_block()
+        self.journal.record(self.journal_block, amount)
+
+    def transaction_history(self, limit: int = HISTORY_DEPTH) -> list[float]:
+        return self.journal.history(self.journal_block, limit)
+
+    def reverse_last_transaction(self) -> None:
+        amount = self.journal.last(self.journal_block)
+        if amount is None:
+            raise ValueError("There are no recent transactions to reverse.")
+        if amount > self.balance:
+            raise ValueError(
+                "You cannot reverse a deposit that has already been withdrawn."
+            )
+        self.balance -= amount
+        if amount < 0:
+            self.withdrawal_allowance = min(
+                self.daily_withdrawal_limit, self.withdrawal_allowance - amount
+            )
+        self.journal.pop(self.journal_block)
+        if change_stream is not None:
+            change_stream.emit(("reverse_transaction", self.account_number, -amount))
 
 
 class ATM:
-    def __init__(self, accounts: dict[str, BankAccount]):
+    def __init__(
+        self,
+        accounts: dict[str, BankAccount],
+        withdrawals_per_minute: float = TERMINAL_WITHDRAWALS_PER_MINUTE,
+    ):
         self.accounts = accounts
+        self.withdrawal_rate_limit = TokenBucket(
+            withdrawals_per_minute, withdrawals_per_minute / 60
+        )
 
     @classmethod
     def from_account_dataset(cls, account_dataset: list[AccountData]):
@@ -58,11 +244,51 @@ class ATM:
             }
         )
 
+    # The stages of processing a transaction are separate methods so that
+    # tracing records a span for each of them.
+    def find_account(self, account_number: str) -> BankAccount:
+        return self.accounts[account_number]
+
+    @staticmethod
+    def parse_amount(amount_input: str) -> float:
+        return float(amount_input)
+
+    @staticmethod
+    def success_message(transaction: str, balance: float) -> str:
+        return f"Your {transaction} was successful. Your new balance is {balance}. Thank you!"
+
     def process_deposit(self, account_number: str) -> None:
-        pass
+        amount_input = input("How much would you like to deposit? ")
+        try:
+            amount = self.parse_amount(amount_input)
+        except ValueError:
+            print("That doesn't seem like a number.")
+            return
+        account = self.find_account(account_number)
+        try:
+            account.deposit(amount)
+        except ValueError as error:
+            print(error)
+            return
+        print(self.success_message("deposit", account.balance))
 
     def process_withdrawal(self, account_number: str) -> None:
-        pass
+        if not self.withdrawal_rate_limit.try_consume(1):
+            print("This ATM is handling too many withdrawals. Please try again later.")
+            return
+        amount_input = input("How much would you like to withdraw? ")
+        try:
+            amount = self.parse_amount(amount_input)
+        except ValueError:
+            print("That doesn't seem like a number.")
+            return
+        account = self.find_account(account_number)
+        try:
+            account.withdraw(amount)
+        except ValueError as error:
+            print(error)
+            return
+        print(self.success_message("withdrawal", account.balance))
 
     def serve_customer(self, account_number: str) -> None:
         print(f"Would you like to deposit or withdraw money today?")
@@ -0,0 +1,547 @@
+import argparse
+import builtins
+import io
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from contextlib import redirect_stdout
+from typing import Callable
+
+import bank_challenges
+import pet_shop_challenges
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+MAX_ROWS = 10_000_000
+DEFAULT_ROWS = 100_000
+DEFAULT_THRESHOLD = 0.2
+
+
+def synthetic_account_dataset(rows: int) -> list[bank_challenges.AccountData]:
+    templates = itertools.cycle(bank_challenges.account_dataset)
+    return [
+        {
+            "account_number": f"{i:08d}",
+            "customer_name": account_data["customer_name"],
+            "balance": account_data["balance"],
+        }
+        for i, account_data in zip(range(rows), templates)
+    ]
+
+
+def synthetic_pet_dataset(rows: int) -> list[pet_shop_challenges.PetData]:
+    templates = itertools.cycle(pet_shop_challenges.pet_dataset)
+    return [
+        {
+            "name": f"{pet_data['name']} {i}",
+            "age": pet_data["age"],
+            "species": pet_data["species"],
+        }
+        for i, pet_data in zip(range(rows), templates)
+    ]
+
+
+def seconds_per_call(
+    function: Callable[[], object], number: int, repeat: int = 5
+) -> float:
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+WITHDRAWAL_LIMIT_BUDGET_SECONDS = 1e-6
+
+
+class UnlimitedBankAccount(bank_challenges.BankAccount):
+    __slots__ = ()
+    daily_withdrawal_limit = 1e18
+
+
+class LimitFreeBankAccount(UnlimitedBankAccount):
+    __slots__ = ()
+
+    # BankAccount.withdraw without the daily limit, as the baseline for the
+    # limit overhead. test_benchmarks_limit_free_baseline_matches_withdrawal
+    # checks that it stays in step with BankAccount.withdraw.
+    def withdraw(self, amount: float) -> None:
+        if amount <= 0:
+            raise ValueError("We only accept withdrawals of positive amounts.")
+        if amount > self.balance:
+            raise ValueError("You cannot withdraw more than you have in your account.")
+        self.balance -= amount
+        self.record_transaction(-amount)
+        change_stream = bank_challenges.change_stream
+        if change_stream is not None:
+            change_stream.emit(("withdraw", self.account_number, -amount))
+
+
+class LimitFreeATM(bank_challenges.ATM):
+    # ATM.process_withdrawal without the terminal rate limit, as the baseline
+    # for the limit overhead. test_benchmarks_limit_free_baseline_matches_withdrawal
+    # checks that it stays in step with ATM.process_withdrawal.
+    def process_withdrawal(self, account_number: str) -> None:
+        amount_input = input("How much would you like to withdraw? ")
+        try:
+            amount = self.parse_amount(amount_input)
+        except ValueError:
+            print("That doesn't seem like a number.")
+            return
+        account = self.find_account(account_number)
+        try:
+            account.withdraw(amount)
+        except ValueError as error:
+            print(error)
+            return
+        print(self.success_message("withdrawal", account.balance))
+
+
+def unlimited_account(
+    account_class: type[bank_challenges.BankAccount] = UnlimitedBankAccount,
+) -> bank_challenges.BankAccount:
+    return account_class(
+        "12169553", "Alice Smith", float("inf"), bank_challenges.TransactionJournal()
+    )
+
+
+def benchmark_deposit(rows: int) -> float:
+    bank_account = unlimited_account()
+    return seconds_per_call(lambda: bank_account.deposit(30), number=100_000)
+
+
+def benchmark_withdraw(rows: int) -> float:
+    bank_account = unlimited_account()
+    return seconds_per_call(lambda: bank_account.withdraw(12), number=100_000)
+
+
+def benchmark_memory_per_account(rows: int) -> float:
+    journal = bank_challenges.TransactionJournal()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    accounts = [
+        bank_challenges.BankAccount(
+            account_data["account_number"],
+            account_data["customer_name"],
+            account_data["balance"],
+            journal,
+        )
+        for account_data in synthetic_account_dataset(min(rows, 100_000))
+    ]
+    for account in accounts:
+        account.deposit(30)
+        account.withdraw(12)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / len(accounts)
+
+
+def benchmark_history_query(rows: int) -> float:
+    bank_account = unlimited_account()
+    for _ in range(10):
+        bank_account.deposit(30)
+        bank_account.withdraw(12)
+    return seconds_per_call(bank_account.transaction_history, number=100_000)
+
+
+def time_atm_withdrawal(atm: bank_challenges.ATM) -> float:
+    atm.accounts["12169553"].balance = float("inf")
+    original_input = builtins.input
+    builtins.input = lambda prompt="": "12"
+    try:
+        with redirect_stdout(io.StringIO()) as output:
+            seconds = seconds_per_call(
+                lambda: atm.process_withdrawal("12169553"), number=20_000, repeat=1
+            )
+            output.truncate(0)
+            return seconds
+    finally:
+        builtins.input = original_input
+
+
+def benchmark_withdrawal_limit_overhead(rows: int) -> float:
+    # The time the daily and terminal limits add to ATM.process_withdrawal,
+    # against the same withdrawal with both limits left out. The two are timed
+    # in alternating rounds so that drift on the machine affects both alike.
+    limited_atm = bank_challenges.ATM({"12169553": unlimited_account()})
+    limited_atm.withdrawal_rate_limit = bank_challenges.TokenBucket(1e18, 0)
+    limit_free_atm = LimitFreeATM({"12169553": unlimited_account(LimitFreeBankAccount)})
+    limited_seconds = []
+    limit_free_seconds = []
+    for _ in range(10):
+        limited_seconds.append(time_atm_withdrawal(limited_atm))
+        limit_free_seconds.append(time_atm_withdrawal(limit_free_atm))
+    return max(0.0, min(limited_seconds) - min(limit_free_seconds))
+
+
+def benchmark_atm_from_account_dataset(rows: int) -> float:
+    account_dataset = synthetic_account_dataset(rows)
+    return seconds_per_call(
+        lambda: bank_challenges.ATM.from_account_dataset(account_dataset),
+        number=1,
+        repeat=3,
+    )
+
+
+def benchmark_atm_session(rows: int) -> float:
+    atm = bank_challenges.ATM.from_account_dataset(synthetic_account_dataset(rows))
+    atm.withdrawal_rate_limit = bank_challenges.TokenBucket(1e18, 0)
+    account_number = f"{rows - 1:08d}"
+    atm.accounts[account_number] = unlimited_account()
+    responses = itertools.cycle([account_number, "d", "30", account_number, "w", "12"])
+    original_input = builtins.input
+    builtins.input = lambda prompt="": next(responses)
+    try:
+        with redirect_stdout(io.StringIO()):
+            return seconds_per_call(atm.menu, number=10_000)
+    finally:
+        builtins.input = original_input
+
+
+def benchmark_atm_session_traced(rows: int) -> float:
+    import tracing
+
+    tracing.enable_tracing()
+    try:
+        return benchmark_atm_session(rows)
+    finally:
+        tracing.disable_tracing()
+
+
+def benchmark_atm_session_after_tracing(rows: int) -> float:
+    # Compare with atm_session_seconds: once tracing is disabled, sessions
+    # should run exactly as fast as if it had never been enabled.
+    import tracing
+
+    tracing.enable_tracing()
+    tracing.disable_tracing()
+    return benchmark_atm_session(rows)
+
+
+def benchmark_pet_shop_from_pet_dataset(rows: int) -> float:
+    pet_dataset = synthetic_pet_dataset(rows)
+    return seconds_per_call(
+        lambda: pet_shop_challenges.PetShop.from_pet_dataset(pet_dataset),
+        number=1,
+        repeat=3,
+    )
+
+
+def benchmark_find_pet_with_name(rows: int) -> float:
+    pet_dataset = synthetic_pet_dataset(rows)
+    pet_shop = pet_shop_challenges.PetShop.from_pet_dataset(pet_dataset)
+    name = pet_dataset[-1]["name"]
+    return seconds_per_call(lambda: pet_shop.find_pet_with_name(name), number=10)
+
+
+def benchmark_add_pet(rows: int) -> float:
+    pet_shop = pet_shop_challenges.PetShop.from_pet_dataset(synthetic_pet_dataset(rows))
+    pet = pet_shop_challenges.Dog("Spot", 5)
+    with redirect_stdout(io.StringIO()):
+        return seconds_per_call(lambda: pet_shop.add_pet(pet), number=10_000)
+
+
+def benchmark_sell_pet(rows: int) -> float:
+    pet_shop = pet_shop_challenges.PetShop.from_pet_dataset(synthetic_pet_dataset(rows))
+    pet = pet_shop.pets[-1]
+
+    # Selling the last pet scans the whole shop; restock it so every sale
+    # sees the same shop size.
+    def sell_and_restock() -> None:
+        pet_shop.sell_pet(pet)
+        pet_shop.pets.append(pet)
+
+    with redirect_stdout(io.StringIO()):
+        return seconds_per_call(sell_and_restock, number=10)
+
+
+def time_concurrent_sales(pet_shop, channel_pets: list[list]) -> float:
+    # Each sales channel is a thread selling its own list of pets; the result
+    # is the time per pet that ends up sold.
+    threads = [
+        threading.Thread(
+            target=lambda pets=pets: [pet_shop.sell_pet(pet) for pet in pets]
+        )
+        for pets in channel_pets
+    ]
+    sale_count = len(pet_shop.pets)
+    with redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return (time.perf_counter() - start) / sale_count
+
+
+def benchmark_concurrent_sell_pet(rows: int) -> float:
+    import concurrent_pet_shop
+
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        synthetic_pet_dataset(min(rows, 100_000))
+    )
+    # One sales channel per species, each selling its species in shop order, so
+    # the channels only ever contend on the shared stdout.
+    return time_concurrent_sales(
+        pet_shop, [list(shard.pets) for shard in pet_shop.shards.values()]
+    )
+
+
+def benchmark_contended_concurrent_sell_pet(rows: int) -> float:
+    import concurrent_pet_shop
+
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        [
+            {"name": f"Spot {i}", "age": 5, "species": "dog"}
+            for i in range(min(rows, 5_000))
+        ]
+    )
+    # A web and an in-store channel sell alternate dogs from the same shard,
+    # starting at the back. Every scan is long enough that the other channel
+    # often sells a dog during it, so sales regularly go through the version
+    # check and retry in SpeciesShard.claim.
+    pets = pet_shop.pets[::-1]
+    return time_concurrent_sales(pet_shop, [pets[0::2], pets[1::2]])
+
+
+def benchmark_persistent_pet_shop_open(rows: int) -> float:
+    # Compare with pet_shop_from_pet_dataset_seconds, the cost of rebuilding
+    # the same inventory from scratch.
+    import pet_inventory
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "pets.db")
+        pet_inventory.PersistentPetShop.from_pet_dataset(
+            synthetic_pet_dataset(rows), path
+        ).close()
+        return seconds_per_call(
+            lambda: pet_inventory.PersistentPetShop(path).close(), number=100
+        )
+
+
+def benchmark_persistent_pet_shop_mutation(rows: int) -> float:
+    import pet_inventory
+
+    with tempfile.TemporaryDirectory() as directory:
+        pet_shop = pet_inventory.PersistentPetShop.from_pet_dataset(
+            synthetic_pet_dataset(rows), os.path.join(directory, "pets.db")
+        )
+        pet = pet_shop_challenges.Dog("Spot", 5)
+
+        def add_celebrate_and_sell() -> None:
+            pet_shop.add_pet(pet)
+            pet_shop.celebrate_birthday(pet)
+            pet_shop.sell_pet(pet)
+
+        with redirect_stdout(io.StringIO()):
+            seconds = seconds_per_call(add_celebrate_and_sell, number=1_000) / 3
+        pet_shop.close()
+        return seconds
+
+
+def benchmark_change_stream_throughput(rows: int) -> float:
+    import change_events
+
+    stream = change_events.ChangeStream()
+    subscription = stream.subscribe()
+    event_count = 1_000_000
+    received = 0
+
+    def consume() -> None:
+        nonlocal received
+        while received < event_count:
+            received += len(subscription.poll(timeout=1))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    start = time.perf_counter()
+    for i in range(event_count):
+        stream.emit(("deposit", "12169553", i))
+    consumer.join()
+    return (time.perf_counter() - start) / event_count
+
+
+def benchmark_deposit_with_change_stream(rows: int) -> float:
+    # Compare with bank_account_deposit_seconds for the overhead the stream
+    # adds to the hot path.
+    import change_events
+
+    stream = change_events.ChangeStream()
+    stream.attach()
+    try:
+        return benchmark_deposit(rows)
+    finally:
+        stream.detach()
+
+
+def benchmark_import_time(rows: int) -> float:
+    # Parse the cumulative import time, in microseconds, of the two challenge
+    # modules from `python -X importtime`, in a fresh interpreter every run.
+    timings = []
+    for _ in range(5):
+        completed = subprocess.run(
+            [
+                sys.executable,
+                "-X",
+                "importtime",
+                "-c",
+                "import bank_challenges, pet_shop_challenges",
+            ],
+            cwd=REPOSITORY_DIRECTORY,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        timings.append(
+            sum(
+                int(line.split("|")[1])
+                for line in completed.stderr.splitlines()
+                if line.split("|")[-1].strip()
+                in ("bank_challenges", "pet_shop_challenges")
+            )
+            / 1e6
+        )
+    return min(timings)
+
+
+def benchmark_time_to_first_prompt(rows: int) -> float:
+    prompt = b"Please enter your account number: "
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, "bank_challenges.py"],
+            cwd=REPOSITORY_DIRECTORY,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        assert process.stdout is not None
+        output = b""
+        while not output.endswith(prompt):
+            chunk = os.read(process.stdout.fileno(), 4096)
+            if not chunk:
+                raise RuntimeError("bank_challenges.py exited before prompting")
+            output += chunk
+        timings.append(time.perf_counter() - start)
+        process.kill()
+        process.wait()
+    return min(timings)
+
+
+def benchmark_pet_shop_script(rows: int) -> float:
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "pet_shop_challenges.py"],
+            cwd=REPOSITORY_DIRECTORY,
+            capture_output=True,
+            check=True,
+        )
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+BUDGETS = {"withdrawal_limit_overhead_seconds": WITHDRAWAL_LIMIT_BUDGET_SECONDS}
+
+BENCHMARKS: dict[str, Callable[[int], float]] = {
+    "bank_account_deposit_seconds": benchmark_deposit,
+    "bank_account_withdraw_seconds": benchmark_withdraw,
+    "bank_account_memory_bytes": benchmark_memory_per_account,
+    "bank_account_history_query_seconds": benchmark_history_query,
+    "withdrawal_limit_overhead_seconds": benchmark_withdrawal_limit_overhead,
+    "atm_from_account_dataset_seconds": benchmark_atm_from_account_dataset,
+    "atm_session_seconds": benchmark_atm_session,
+    "atm_session_traced_seconds": benchmark_atm_session_traced,
+    "atm_session_after_tracing_seconds": benchmark_atm_session_after_tracing,
+    "pet_shop_from_pet_dataset_seconds": benchmark_pet_shop_from_pet_dataset,
+    "pet_shop_find_pet_with_name_seconds": benchmark_find_pet_with_name,
+    "pet_shop_add_pet_seconds": benchmark_add_pet,
+    "pet_shop_sell_pet_seconds": benchmark_sell_pet,
+    "concurrent_pet_shop_sell_pet_seconds": benchmark_concurrent_sell_pet,
+    "concurrent_pet_shop_contended_sell_pet_seconds": benchmark_contended_concurrent_sell_pet,
+    "persistent_pet_shop_open_seconds": benchmark_persistent_pet_shop_open,
+    "persistent_pet_shop_mutation_seconds": benchmark_persistent_pet_shop_mutation,
+    "change_stream_event_seconds": benchmark_change_stream_throughput,
+    "bank_account_deposit_with_change_stream_seconds": benchmark_deposit_with_change_stream,
+    "import_seconds": benchmark_import_time,
+    "bank_time_to_first_prompt_seconds": benchmark_time_to_first_prompt,
+    "pet_shop_script_seconds": benchmark_pet_shop_script,
+}
+
+
+def run_benchmarks(rows: int, names: list[str]) -> dict[str, float]:
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](rows)
+        print(f"{name}: {results[name]:.3g}", file=sys.stderr)
+    return results
+
+
+def find_budget_overruns(results: dict[str, float]) -> list[str]:
+    return [
+        f"{name} of {results[name]:.3g} is over its budget of {budget:.3g}"
+        for name, budget in BUDGETS.items()
+        if name in results and results[name] > budget
+    ]
+
+
+def find_regressions(
+    baseline: dict[str, float], results: dict[str, float], threshold: float
+) -> list[str]:
+    # A baseline of zero, such as an overhead clamped to zero, has no
+    # meaningful relative threshold, so it is not compared.
+    return [
+        f"{name} regressed from {baseline[name]:.3g} to {value:.3g}"
+        for name, value in results.items()
+        if baseline.get(name, 0) > 0 and value > baseline[name] * (1 + threshold)
+    ]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the bank and pet shop models."
+    )
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS)
+    parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS))
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+    if not 0 < args.rows <= MAX_ROWS:
+        parser.error(f"--rows must be between 1 and {MAX_ROWS}")
+
+    report = {
+        "rows": args.rows,
+        "python": platform.python_version(),
+        "results": run_benchmarks(args.rows, args.only or list(BENCHMARKS)),
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    problems = find_budget_overruns(report["results"])
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline["rows"] != args.rows:
+            print(
+                f"Warning: the baseline was run with {baseline['rows']} rows.",
+                file=sys.stderr,
+            )
+        problems += find_regressions(
+            baseline["results"], report["results"], args.threshold
+        )
+    for problem in problems:
+        print(problem, file=sys.stderr)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+import json
+import threading
+from time import monotonic
+from typing import Iterator
+
+import bank_challenges
+import pet_shop_challenges
+
+STREAM_CAPACITY = 65536
+BATCH_SIZE = 1024
+EMIT_WAIT_SECONDS = 1.0
+
+ChangeEvent = tuple[str, str, float, str] | tuple[str, str, float]
+
+
+class ChangeStream:
+    def __init__(
+        self, capacity: int = STREAM_CAPACITY, wait_seconds: float = EMIT_WAIT_SECONDS
+    ):
+        self.capacity = capacity
+        self.wait_seconds = wait_seconds
+        self.events: list[ChangeEvent | None] = [None] * capacity
+        self.next_sequence_number = 0
+        self.subscriptions: list[Subscription] = []
+        self.condition = threading.Condition(threading.Lock())
+        # Threads blocked on the condition, so emit and poll only pay for a
+        # notification when somebody is waiting for one.
+        self.waiting = 0
+
+    def attach(self) -> None:
+        bank_challenges.change_stream = self
+        pet_shop_challenges.change_stream = self
+
+    def detach(self) -> None:
+        bank_challenges.change_stream = None
+        pet_shop_challenges.change_stream = None
+
+    def subscribe(self) -> "Subscription":
+        with self.condition:
+            subscription = Subscription(self, self.next_sequence_number)
+            self.subscriptions.append(subscription)
+            return subscription
+
+    def is_lagging(self, subscription: "Subscription") -> bool:
+        return self.next_sequence_number - subscription.cursor >= self.capacity
+
+    def is_full(self) -> bool:
+        for subscription in self.subscriptions:
+            if self.is_lagging(subscription):
+                return True
+        return False
+
+    def disconnect_lagging(self) -> None:
+        for subscription in list(self.subscriptions):
+            if self.is_lagging(subscription):
+                subscription.disconnected = True
+                self.subscriptions.remove(subscription)
+
+    def emit(self, event: ChangeEvent) -> None:
+        # Without subscribers, the oldest events are simply overwritten. With
+        # them, a full stream blocks the mutation for up to wait_seconds for
+        # the slowest subscriber to catch up. Subscribers that are still a
+        # full stream behind after that are disconnected, so a stalled
+        # subscriber can never hold up mutations for longer.
+        with self.condition:
+            if self.subscriptions and self.is_full():
+                deadline = monotonic() + self.wait_seconds
+                while self.is_full():
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.disconnect_lagging()
+                        break
+                    self.waiting += 1
+                    self.condition.wait(remaining)
+                    self.waiting -= 1
+            self.events[self.next_sequence_number % self.capacity] = event
+            self.next_sequence_number += 1
+            if self.waiting:
+                self.condition.notify_all()
+
+
+class Subscription:
+    def __init__(self, stream: ChangeStream, cursor: int):
+        self.stream = stream
+        self.cursor = cursor
+        self.disconnected = False
+
+    def poll(
+        self, max_events: int = BATCH_SIZE, timeout: float | None = 0
+    ) -> list[ChangeEvent]:
+        stream = self.stream
+        with stream.condition:
+            if self.disconnected:
+                raise ValueError(
+                    "This subscription fell too far behind and was disconnected."
+                )
+            if timeout != 0 and self.cursor == stream.next_sequence_number:
+                stream.waiting += 1
+                stream.condition.wait_for(
+                    lambda: self.cursor < stream.next_sequence_number, timeout
+                )
+                stream.waiting -= 1
+            end = min(stream.next_sequence_number, self.cursor + max_events)
+            batch = [
+                stream.events[sequence_number % stream.capacity]
+                for sequence_number in range(self.cursor, end)
+            ]
+            self.cursor = end
+            if stream.waiting:
+                stream.condition.notify_all()
+        return [event for event in batch if event is not None]
+
+    def close(self) -> None:
+        with self.stream.condition:
+            if self in self.stream.subscriptions:
+                self.stream.subscriptions.remove(self)
+                self.stream.condition.notify_all()
+
+
+class FileSink:
+    def __init__(self, stream: ChangeStream, path: str):
+        self.subscription = stream.subscribe()
+        self.path = path
+
+    def drain(self, timeout: float | None = 0) -> int:
+        batch = self.subscription.poll(timeout=timeout)
+        if batch:
+            with open(self.path, "a") as sink_file:
+                sink_file.writelines(json.dumps(event) + "\n" for event in batch)
+        return len(batch)
+
+    def close(self) -> None:
+        # A disconnected subscription has nothing left that can be drained.
+        while not self.subscription.disconnected and self.drain():
+            pass
+        self.subscription.close()
+
+
+def replay(path: str) -> Iterator[ChangeEvent]:
+    with open(path) as sink_file:
+        for line in sink_file:
+            yield tuple(json.loads(line))
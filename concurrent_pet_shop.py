@@ -0,0 +1,159 @@
+import threading
+from time import monotonic
+from typing import TYPE_CHECKING
+
+import pet_shop_challenges
+from pet_shop_challenges import Animal, PetShop
+
+if TYPE_CHECKING:
+    from change_events import ChangeEvent
+
+RESERVATION_SECONDS = 15 * 60
+
+
+class Reservation:
+    __slots__ = ("pet", "expires_at")
+
+    def __init__(self, pet: Animal, expires_at: float):
+        self.pet = pet
+        self.expires_at = expires_at
+
+
+def emit_change(event: "ChangeEvent") -> None:
+    # Called while holding the shard lock, so that the events for a species
+    # reach the change stream in the same order as the changes themselves.
+    change_stream = pet_shop_challenges.change_stream
+    if change_stream is not None:
+        change_stream.emit(event)
+
+
+class SpeciesShard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pets: list[Animal] = []
+        self.reservations: dict[int, Reservation] = {}
+        # Bumped under the lock by every change to the shard, so that a scan
+        # made without the lock can be checked before acting on it.
+        self.version = 0
+
+    def is_reserved(self, pet: Animal) -> bool:
+        held = self.reservations.get(id(pet))
+        return held is not None and held.expires_at > monotonic()
+
+    def is_held_by(self, pet: Animal, reservation: Reservation) -> bool:
+        # An expired reservation is only dropped when the pet is sold or
+        # reserved by someone else, so until then it can still be checked out.
+        return self.reservations.get(id(pet)) is reservation
+
+    def index_of(self, pet: Animal, reservation: Reservation | None) -> int:
+        for index, candidate in enumerate(self.pets):
+            if reservation is not None:
+                if candidate is reservation.pet:
+                    return index
+            elif candidate == pet and not self.is_reserved(candidate):
+                return index
+        return -1
+
+    def claim(self, pet: Animal, reservation: Reservation | None = None) -> bool:
+        while True:
+            version = self.version
+            index = self.index_of(pet, reservation)
+            with self.lock:
+                if self.version != version:
+                    continue
+                if index < 0:
+                    return False
+                if reservation is None:
+                    if self.is_reserved(self.pets[index]):
+                        return False
+                elif not self.is_held_by(self.pets[index], reservation):
+                    return False
+                claimed_pet = self.pets.pop(index)
+                self.reservations.pop(id(claimed_pet), None)
+                self.version += 1
+                emit_change(
+                    ("sell_pet", claimed_pet.name, claimed_pet.age, claimed_pet.species)
+                )
+                return True
+
+
+class ConcurrentPetShop(PetShop):
+    def __init__(self, pets: list[Animal]):
+        self.shards: dict[str, SpeciesShard] = {}
+        self.shards_lock = threading.Lock()
+        for pet in pets:
+            self.shard(pet.species).pets.append(pet)
+
+    @property
+    def pets(self) -> list[Animal]:
+        return [pet for shard in list(self.shards.values()) for pet in shard.pets]
+
+    def shard(self, species: str) -> SpeciesShard:
+        shard = self.shards.get(species)
+        if shard is None:
+            with self.shards_lock:
+                shard = self.shards.setdefault(species, SpeciesShard())
+        return shard
+
+    def find_pet_with_name(self, name: str) -> Animal:
+        for shard in list(self.shards.values()):
+            for pet in list(shard.pets):
+                if pet.name == name:
+                    return pet
+        raise ValueError(f"No pets called {name} found in our shop.")
+
+    def add_pet(self, pet: Animal) -> None:
+        shard = self.shard(pet.species)
+        with shard.lock:
+            shard.pets.append(pet)
+            shard.version += 1
+            emit_change(("add_pet", pet.name, pet.age, pet.species))
+        print(f"{pet.name} the {pet.species} is now looking for a new home.")
+
+    def sell_pet(self, pet: Animal) -> None:
+        if self.shard(pet.species).claim(pet):
+            self.sold(pet)
+        else:
+            print(f"{pet.name} the {pet.species} is not for sale in our shop.")
+
+    def celebrate_birthday(self, pet: Animal) -> None:
+        # The age is part of what index_of matches on, so the birthday is a
+        # change to the shard like any other.
+        shard = self.shards.get(pet.species)
+        if shard is None:
+            raise ValueError(f"No pets called {pet.name} found in our shop.")
+        with shard.lock:
+            if pet not in shard.pets:
+                raise ValueError(f"No pets called {pet.name} found in our shop.")
+            pet.celebrate_birthday()
+            shard.version += 1
+            emit_change(("celebrate_birthday", pet.name, pet.age, pet.species))
+
+    def sold(self, pet: Animal) -> None:
+        print(f"{pet.name} the {pet.species} has found a new home.")
+
+    def reserve_pet(
+        self, pet: Animal, seconds: float = RESERVATION_SECONDS
+    ) -> Reservation:
+        shard = self.shard(pet.species)
+        while True:
+            version = shard.version
+            index = shard.index_of(pet, None)
+            with shard.lock:
+                if shard.version != version:
+                    continue
+                if index < 0 or shard.is_reserved(shard.pets[index]):
+                    raise ValueError(
+                        f"{pet.name} the {pet.species} is not for sale in our shop."
+                    )
+                reservation = Reservation(shard.pets[index], monotonic() + seconds)
+                shard.reservations[id(reservation.pet)] = reservation
+                shard.version += 1
+                return reservation
+
+    def checkout(self, reservation: Reservation) -> None:
+        pet = reservation.pet
+        if self.shard(pet.species).claim(pet, reservation):
+            self.sold(pet)
+        else:
+            print(f"{pet.name} the {pet.species} is not for sale in our shop.")
@@ -0,0 +1,111 @@
+import sqlite3
+
+import pet_shop_challenges
+from pet_shop_challenges import Animal, PetData, PetShop, animal_from_pet_data
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    age INTEGER NOT NULL,
+    species TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pets_by_name ON pets (name, age, species);
+CREATE INDEX IF NOT EXISTS pets_by_species ON pets (species);
+"""
+
+FIRST_MATCHING_PET = """
+SELECT id FROM pets WHERE name = ? AND age = ? AND species = ? ORDER BY id LIMIT 1
+"""
+
+
+def animal_from_row(row: tuple[str, int, str]) -> Animal:
+    name, age, species = row
+    return animal_from_pet_data({"name": name, "age": age, "species": species})
+
+
+class PersistentPetShop(PetShop):
+    def __init__(self, path: str):
+        # Opening only creates the schema if it is missing, so it takes the
+        # same time however many pets the inventory holds.
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def from_pet_dataset(cls, pet_dataset: list[PetData], path: str = ":memory:"):
+        pet_shop = cls(path)
+        with pet_shop.connection:
+            pet_shop.connection.executemany(
+                "INSERT INTO pets (name, age, species) VALUES (?, ?, ?)",
+                (
+                    (pet_data["name"], pet_data["age"], pet_data["species"])
+                    for pet_data in pet_dataset
+                ),
+            )
+        return pet_shop
+
+    @property
+    def pets(self) -> list[Animal]:
+        rows = self.connection.execute(
+            "SELECT name, age, species FROM pets ORDER BY id"
+        )
+        return [animal_from_row(row) for row in rows]
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def find_pet_with_name(self, name: str) -> Animal:
+        row = self.connection.execute(
+            "SELECT name, age, species FROM pets WHERE name = ? ORDER BY id LIMIT 1",
+            (name,),
+        ).fetchone()
+        if row is None:
+            raise ValueError(f"No pets called {name} found in our shop.")
+        return animal_from_row(row)
+
+    def find_pets_of_species(self, species: str) -> list[Animal]:
+        rows = self.connection.execute(
+            "SELECT name, age, species FROM pets WHERE species = ? ORDER BY id",
+            (species,),
+        )
+        return [animal_from_row(row) for row in rows]
+
+    def add_pet(self, pet: Animal) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO pets (name, age, species) VALUES (?, ?, ?)",
+                (pet.name, pet.age, pet.species),
+            )
+        change_stream = pet_shop_challenges.change_stream
+        if change_stream is not None:
+            change_stream.emit(("add_pet", pet.name, pet.age, pet.species))
+        print(f"{pet.name} the {pet.species} is now looking for a new home.")
+
+    def sell_pet(self, pet: Animal) -> None:
+        with self.connection:
+            cursor = self.connection.execute(
+                f"DELETE FROM pets WHERE id = ({FIRST_MATCHING_PET})",
+                (pet.name, pet.age, pet.species),
+            )
+        if cursor.rowcount:
+            change_stream = pet_shop_challenges.change_stream
+            if change_stream is not None:
+                change_stream.emit(("sell_pet", pet.name, pet.age, pet.species))
+            print(f"{pet.name} the {pet.species} has found a new home.")
+        else:
+            print(f"{pet.name} the {pet.species} is not for sale in our shop.")
+
+    def celebrate_birthday(self, pet: Animal) -> None:
+        with self.connection:
+            cursor = self.connection.execute(
+                f"UPDATE pets SET age = age + 1 WHERE id = ({FIRST_MATCHING_PET})",
+                (pet.name, pet.age, pet.species),
+            )
+        if not cursor.rowcount:
+            raise ValueError(f"No pets called {pet.name} found in our shop.")
+        pet.celebrate_birthday()
+        change_stream = pet_shop_challenges.change_stream
+        if change_stream is not None:
+            change_stream.emit(("celebrate_birthday", pet.name, pet.age, pet.species))
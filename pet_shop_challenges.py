@@ -1,4 +1,7 @@
-from typing import TypedDict
+from typing import TYPE_CHECKING, TypedDict
+
+if TYPE_CHECKING:
+    from change_events import ChangeStream
 
 
 class PetData(TypedDict):
@@ -18,52 +21,93 @@ pet_dataset: list[PetData] = [
 ]
 
 
+# Set by ChangeStream.attach; while it is None, mutations emit no events.
+change_stream: "ChangeStream | None" = None
+
+
 class Animal:
     def __init__(self, name: str, age: int, species: str):
-        pass
+        self.name = name
+        self.age = age
+        self.species = species
 
     def __repr__(self):
-        return ""
+        return f"{self.name}, {self.age} ({self.species})"
 
     def __eq__(self, other_animal):
-        return False
+        if not isinstance(other_animal, Animal):
+            return NotImplemented
+        return (
+            self.name == other_animal.name
+            and self.age == other_animal.age
+            and self.species == other_animal.species
+        )
 
     def celebrate_birthday(self) -> None:
-        pass
+        self.age += 1
+        print(f"It's {self.name}'s birthday.")
 
 
 class Dog(Animal):
     def __init__(self, name: str, age: int):
-        pass
+        super().__init__(name, age, "dog")
 
     def woof(self) -> None:
-        pass
+        print(f"{self.name} says woof!")
 
 
 class Cat(Animal):
     def __init__(self, name: str, age: int):
-        pass
+        super().__init__(name, age, "cat")
 
     def meow(self) -> None:
-        pass
+        print(f"{self.name} says meow!")
+
+
+def animal_from_pet_data(pet_data: PetData) -> Animal:
+    if pet_data["species"] == "dog":
+        return Dog(pet_data["name"], pet_data["age"])
+    elif pet_data["species"] == "cat":
+        return Cat(pet_data["name"], pet_data["age"])
+    else:
+        return Animal(pet_data["name"], pet_data["age"], pet_data["species"])
 
 
 class PetShop:
     def __init__(self, pets: list[Animal]):
-        pass
+        self.pets = pets
 
     @classmethod
     def from_pet_dataset(cls, pet_dataset: list[PetData]):
-        pass
+        return cls([animal_from_pet_data(pet_data) for pet_data in pet_dataset])
 
     def find_pet_with_name(self, name: str) -> Animal:
+        for pet in self.pets:
+            if pet.name == name:
+                return pet
         raise ValueError(f"No pets called {name} found in our shop.")
 
     def add_pet(self, pet: Animal) -> None:
-        pass
+        self.pets.append(pet)
+        if change_stream is not None:
+            change_stream.emit(("add_pet", pet.name, pet.age, pet.species))
+        print(f"{pet.name} the {pet.species} is now looking for a new home.")
 
     def sell_pet(self, pet: Animal) -> None:
-        pass
+        if pet in self.pets:
+            self.pets.remove(pet)
+            if change_stream is not None:
+                change_stream.emit(("sell_pet", pet.name, pet.age, pet.species))
+            print(f"{pet.name} the {pet.species} has found a new home.")
+        else:
+            print(f"{pet.name} the {pet.species} is not for sale in our shop.")
+
+    def celebrate_birthday(self, pet: Animal) -> None:
+        if pet not in self.pets:
+            raise ValueError(f"No pets called {pet.name} found in our shop.")
+        pet.celebrate_birthday()
+        if change_stream is not None:
+            change_stream.emit(("celebrate_birthday", pet.name, pet.age, pet.species))
 
 
 if __name__ == "__main__":
@@ -1,10 +1,18 @@
 import pytest
 from pytest_mock import MockerFixture
 
+import gc
+import pathlib
+import threading
 from io import StringIO
 
 import bank_challenges
+import benchmarks
+import change_events
+import concurrent_pet_shop
+import pet_inventory
 import pet_shop_challenges
+import tracing
 
 
 @pytest.mark.parametrize(
@@ -138,6 +146,110 @@ def test_bank_account_with_invalid_withdrawal(
     ), "Failed withdrawal should not affect balance"
 
 
+@pytest.mark.parametrize(
+    "transactions, expected_history",
+    [
+        ([("deposit", 30), ("withdraw", 12)], [-12, 30]),
+        ([("withdraw", 20), ("deposit", 5), ("deposit", 10)], [10, 5, -20]),
+    ],
+)
+def test_bank_account_transaction_history(
+    transactions: list[tuple[str, float]], expected_history: list[float]
+) -> None:
+    bank_account = bank_challenges.BankAccount(
+        "12169553", "Alice Smith", 50, bank_challenges.TransactionJournal()
+    )
+    for action, amount in transactions:
+        getattr(bank_account, action)(amount)
+    assert (
+        bank_account.transaction_history() == expected_history
+    ), f"History should list the most recent transactions first"
+
+
+def test_bank_account_transaction_history_is_kept_per_account() -> None:
+    journal = bank_challenges.TransactionJournal(depth=3)
+    alice = bank_challenges.BankAccount("12169553", "Alice Smith", 50, journal)
+    bob = bank_challenges.BankAccount("82309802", "Bob Jones", 200, journal)
+    alice.deposit(1)
+    for amount in [2, 3, 4, 5]:
+        bob.deposit(amount)
+    assert alice.transaction_history() == [1]
+    assert bob.transaction_history() == [5, 4, 3]
+    assert bob.transaction_history(limit=2) == [5, 4]
+    for _ in range(3):
+        bob.reverse_last_transaction()
+    assert bob.balance == 202
+    assert bob.transaction_history() == []
+    alice.reverse_last_transaction()
+    assert alice.balance == 50
+
+
+def test_bank_account_journal_block_is_reused_after_account_is_discarded() -> None:
+    journal = bank_challenges.TransactionJournal(depth=3)
+
+    def make_deposit(account_number: str) -> None:
+        bank_challenges.BankAccount(account_number, "Alice Smith", 50, journal).deposit(
+            1
+        )
+
+    for i in range(1000):
+        make_deposit(str(i))
+    gc.collect()
+    assert journal.block_count() == 0
+    assert len(journal.lengths) == 1
+    bob = bank_challenges.BankAccount("82309802", "Bob Jones", 200, journal)
+    bob.deposit(5)
+    assert bob.transaction_history() == [5]
+    assert journal.block_count() == 1
+
+
+@pytest.mark.parametrize(
+    "action, amount, initial_balance",
+    [
+        ("deposit", 30, 50),
+        ("withdraw", 12, 200),
+    ],
+)
+def test_bank_account_reverse_last_transaction(
+    action: str, amount: float, initial_balance: float
+) -> None:
+    bank_account = bank_challenges.BankAccount(
+        "12169553", "Alice Smith", initial_balance, bank_challenges.TransactionJournal()
+    )
+    bank_account.deposit(5)
+    getattr(bank_account, action)(amount)
+    bank_account.reverse_last_transaction()
+    assert (
+        bank_account.balance == initial_balance + 5
+    ), f"Reversing a {action} of {amount} should restore the previous balance"
+    assert bank_account.transaction_history() == [5]
+
+
+def test_bank_account_reverse_without_transactions() -> None:
+    bank_account = bank_challenges.BankAccount(
+        "12169553", "Alice Smith", 50, bank_challenges.TransactionJournal()
+    )
+    with pytest.raises(ValueError) as error:
+        bank_account.reverse_last_transaction()
+    assert str(error.value) == "There are no recent transactions to reverse."
+    assert bank_account.balance == 50, "Failed reversal should not affect balance"
+
+
+def test_bank_account_reverse_deposit_that_has_been_spent() -> None:
+    bank_account = bank_challenges.BankAccount(
+        "12169553", "Alice Smith", 50, bank_challenges.TransactionJournal()
+    )
+    bank_account.deposit(30)
+    bank_account.balance = 10
+    with pytest.raises(ValueError) as error:
+        bank_account.reverse_last_transaction()
+    assert (
+        str(error.value)
+        == "You cannot reverse a deposit that has already been withdrawn."
+    )
+    assert bank_account.balance == 10, "Failed reversal should not affect balance"
+
+
 @pytest.mark.parametrize(
     "account_number, deposit_amount_input, expected_success_message",
     [
@@ -261,6 +373,80 @@ def test_atm_process_withdrawal_with_invalid_input(
     ), f"Deposit of {withdrawal_amount_input} should generate error message {expected_error_message}"
 
 
+@pytest.mark.parametrize(
+    "daily_withdrawal_limit, withdrawal_amounts, expected_balance",
+    [
+        (100, [60, 40], 100),
+        (50, [30, 12], 158),
+    ],
+)
+def test_bank_account_withdrawal_over_daily_limit(
+    mocker: MockerFixture,
+    daily_withdrawal_limit: float,
+    withdrawal_amounts: list[float],
+    expected_balance: float,
+) -> None:
+    mocker.patch("bank_challenges.monotonic", return_value=0.0)
+    mocker.patch.object(
+        bank_challenges.BankAccount, "daily_withdrawal_limit", daily_withdrawal_limit
+    )
+    bank_account = bank_challenges.BankAccount(
+        "82309802", "Bob Jones", 200, bank_challenges.TransactionJournal()
+    )
+    for amount in withdrawal_amounts:
+        bank_account.withdraw(amount)
+    with pytest.raises(ValueError) as error:
+        bank_account.withdraw(10)
+    assert (
+        str(error.value) == "You cannot withdraw more than your daily limit allows."
+    ), f"Withdrawing over the daily limit of {daily_withdrawal_limit} should fail"
+    assert (
+        bank_account.balance == expected_balance
+    ), "Failed withdrawal should not affect balance"
+
+
+def test_bank_account_daily_limit_refills_over_time(mocker: MockerFixture) -> None:
+    clock = mocker.patch("bank_challenges.monotonic", return_value=0.0)
+    mocker.patch.object(bank_challenges.BankAccount, "daily_withdrawal_limit", 100)
+    mocker.patch.object(
+        bank_challenges.BankAccount,
+        "withdrawal_refill_per_second",
+        100 / bank_challenges.SECONDS_PER_DAY,
+    )
+    bank_account = bank_challenges.BankAccount(
+        "82309802", "Bob Jones", 200, bank_challenges.TransactionJournal()
+    )
+    bank_account.withdraw(100)
+    clock.return_value = bank_challenges.SECONDS_PER_DAY / 2
+    bank_account.withdraw(50)
+    with pytest.raises(ValueError):
+        bank_account.withdraw(1)
+    bank_account.reverse_last_transaction()
+    bank_account.withdraw(50)
+    assert bank_account.balance == 50
+
+
+def test_atm_process_withdrawal_over_terminal_rate_limit(
+    mocker: MockerFixture,
+) -> None:
+    clock = mocker.patch("bank_challenges.monotonic", return_value=0.0)
+    atm = bank_challenges.ATM.from_account_dataset(bank_challenges.account_dataset)
+    atm.withdrawal_rate_limit = bank_challenges.TokenBucket(2, 2 / 60)
+    mocker.patch("builtins.input", side_effect=["1", "1", "1"])
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    for _ in range(3):
+        atm.process_withdrawal("82309802")
+    clock.return_value = 30.0
+    atm.process_withdrawal("82309802")
+    outputted_lines = mock_stdout.getvalue().splitlines()
+    assert outputted_lines == [
+        "Your withdrawal was successful. Your new balance is 199.0. Thank you!",
+        "Your withdrawal was successful. Your new balance is 198.0. Thank you!",
+        "This ATM is handling too many withdrawals. Please try again later.",
+        "Your withdrawal was successful. Your new balance is 197.0. Thank you!",
+    ]
+
+
 @pytest.mark.parametrize(
     "name, age, species",
     [
@@ -313,6 +499,13 @@ def test_animal_eq(
     ), f"{animal_1} and {animal_2} are {'' if should_be_equal else 'not '}the same"
 
 
+@pytest.mark.parametrize("other", [None, "Spot, 5 (dog)", 5])
+def test_animal_is_not_equal_to_other_types(other: object) -> None:
+    animal = pet_shop_challenges.Dog(name="Spot", age=5)
+    assert animal != other
+    assert animal not in [other]
+
+
 @pytest.mark.parametrize(
     "name, age, species, birthday_message",
     [
@@ -669,3 +862,472 @@ def test_pet_shop_sell_pet_with_pet_not_in_shop(
     assert (
         outputted_lines[-1] == expected_message
     ), f'Absent pet should print message "{expected_message}"'
+
+
+@pytest.mark.parametrize(
+    "baseline, results, expected_regressions",
+    [
+        (
+            {"pet_shop_add_pet_seconds": 1.0, "atm_session_seconds": 2.0},
+            {"pet_shop_add_pet_seconds": 1.1, "atm_session_seconds": 2.5},
+            ["atm_session_seconds regressed from 2 to 2.5"],
+        ),
+        (
+            {"pet_shop_add_pet_seconds": 1.0},
+            {"pet_shop_add_pet_seconds": 0.5, "atm_session_seconds": 2.5},
+            [],
+        ),
+        (
+            {"withdrawal_limit_overhead_seconds": 0.0},
+            {"withdrawal_limit_overhead_seconds": 1e-9},
+            [],
+        ),
+    ],
+)
+def test_benchmarks_find_regressions(
+    baseline: dict[str, float],
+    results: dict[str, float],
+    expected_regressions: list[str],
+) -> None:
+    assert (
+        benchmarks.find_regressions(baseline, results, threshold=0.2)
+        == expected_regressions
+    )
+
+
+@pytest.mark.parametrize("amount_input", ["12", "200", "250", "0", "-5", "abc"])
+def test_benchmarks_limit_free_baseline_matches_withdrawal(
+    mocker: MockerFixture, amount_input: str
+) -> None:
+    # The limit overhead baseline copies ATM.process_withdrawal and
+    # BankAccount.withdraw without the limits, so with limits that are never
+    # reached, both must behave exactly alike.
+    def withdraw(atm: bank_challenges.ATM) -> tuple[str, float, list[float], list]:
+        stream = change_events.ChangeStream()
+        stream.attach()
+        subscription = stream.subscribe()
+        mocker.patch("builtins.input", return_value=amount_input)
+        mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+        try:
+            atm.process_withdrawal("12169553")
+        finally:
+            stream.detach()
+        account = atm.accounts["12169553"]
+        return (
+            mock_stdout.getvalue(),
+            account.balance,
+            account.transaction_history(),
+            subscription.poll(),
+        )
+
+    limited_atm = bank_challenges.ATM(
+        {"12169553": benchmarks.UnlimitedBankAccount("12169553", "Alice Smith", 200)}
+    )
+    limited_atm.withdrawal_rate_limit = bank_challenges.TokenBucket(1e18, 0)
+    limit_free_atm = benchmarks.LimitFreeATM(
+        {"12169553": benchmarks.LimitFreeBankAccount("12169553", "Alice Smith", 200)}
+    )
+    assert withdraw(limit_free_atm) == withdraw(limited_atm)
+
+
+def test_tracing_records_atm_session_spans(mocker: MockerFixture) -> None:
+    atm = bank_challenges.ATM.from_account_dataset(bank_challenges.account_dataset)
+    original_deposit = bank_challenges.BankAccount.deposit
+    mocker.patch("builtins.input", side_effect=["12169553", "d", "30"])
+    mocker.patch("sys.stdout", new_callable=StringIO)
+    tracer = tracing.enable_tracing(tracing.Tracer(capacity=8))
+    try:
+        atm.menu()
+    finally:
+        tracing.disable_tracing()
+    assert bank_challenges.BankAccount.deposit is original_deposit
+    assert "input" not in vars(bank_challenges)
+    assert [span[0] for span in tracer.spans()] == [
+        "ATM.parse_amount",
+        "ATM.find_account",
+        "BankAccount.deposit",
+        "ATM.success_message",
+        "print",
+        "ATM.process_deposit",
+        "ATM.serve_customer",
+        "ATM.menu",
+    ]
+    assert tracer.span_count == 16
+    trace_events = tracer.chrome_trace()["traceEvents"]
+    assert trace_events[-1]["name"] == "ATM.menu"
+    assert trace_events[-1]["ph"] == "X"
+
+
+def test_tracer_records_spans_from_many_threads() -> None:
+    tracer = tracing.Tracer(capacity=4096)
+
+    def record_spans(name: str) -> None:
+        for start in range(1000):
+            tracer.record(name, start, 1)
+
+    threads = [
+        threading.Thread(target=record_spans, args=(f"thread-{i}",)) for i in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert tracer.span_count == 4000
+    spans = tracer.spans()
+    for i in range(4):
+        assert [span[1] for span in spans if span[0] == f"thread-{i}"] == list(
+            range(1000)
+        )
+
+
+def test_concurrent_pet_shop_reservation(mocker: MockerFixture) -> None:
+    mocker.patch("concurrent_pet_shop.monotonic", return_value=0.0)
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    spot = pet_shop_challenges.Dog(name="Spot", age=5)
+    reservation = pet_shop.reserve_pet(spot, seconds=60)
+    with pytest.raises(ValueError) as error:
+        pet_shop.reserve_pet(spot)
+    assert str(error.value) == "Spot the dog is not for sale in our shop."
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.sell_pet(spot)
+    pet_shop.checkout(reservation)
+    pet_shop.checkout(reservation)
+    assert mock_stdout.getvalue().splitlines() == [
+        "Spot the dog is not for sale in our shop.",
+        "Spot the dog has found a new home.",
+        "Spot the dog is not for sale in our shop.",
+    ]
+    assert spot not in pet_shop.pets
+    assert len(pet_shop.pets) == len(pet_shop_challenges.pet_dataset) - 1
+
+
+def test_concurrent_pet_shop_reservation_expires(mocker: MockerFixture) -> None:
+    clock = mocker.patch("concurrent_pet_shop.monotonic", return_value=0.0)
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    nemo = pet_shop_challenges.Animal(name="Nemo", age=1, species="fish")
+    buddy = pet_shop_challenges.Dog(name="Buddy", age=3)
+    nemo_reservation = pet_shop.reserve_pet(nemo, seconds=60)
+    buddy_reservation = pet_shop.reserve_pet(buddy, seconds=60)
+    clock.return_value = 61.0
+    pet_shop.reserve_pet(buddy, seconds=60)
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.checkout(nemo_reservation)
+    pet_shop.checkout(buddy_reservation)
+    pet_shop.sell_pet(buddy)
+    assert mock_stdout.getvalue().splitlines() == [
+        "Nemo the fish has found a new home.",
+        "Buddy the dog is not for sale in our shop.",
+        "Buddy the dog is not for sale in our shop.",
+    ]
+
+
+def test_concurrent_pet_shop_expired_reservation_lost_to_sale(
+    mocker: MockerFixture,
+) -> None:
+    clock = mocker.patch("concurrent_pet_shop.monotonic", return_value=0.0)
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    nemo = pet_shop_challenges.Animal(name="Nemo", age=1, species="fish")
+    reservation = pet_shop.reserve_pet(nemo, seconds=60)
+    clock.return_value = 61.0
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.sell_pet(nemo)
+    pet_shop.checkout(reservation)
+    assert mock_stdout.getvalue().splitlines() == [
+        "Nemo the fish has found a new home.",
+        "Nemo the fish is not for sale in our shop.",
+    ]
+
+
+def test_concurrent_pet_shop_celebrate_birthday(mocker: MockerFixture) -> None:
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    spot = pet_shop.find_pet_with_name("Spot")
+    shard = pet_shop.shard("dog")
+    version = shard.version
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.celebrate_birthday(spot)
+    pet_shop.sell_pet(pet_shop_challenges.Dog(name="Spot", age=5))
+    pet_shop.sell_pet(pet_shop_challenges.Dog(name="Spot", age=6))
+    assert shard.version > version
+    assert mock_stdout.getvalue().splitlines() == [
+        "It's Spot's birthday.",
+        "Spot the dog is not for sale in our shop.",
+        "Spot the dog has found a new home.",
+    ]
+
+
+def test_concurrent_pet_shop_sells_each_pet_once(mocker: MockerFixture) -> None:
+    pet_dataset = benchmarks.synthetic_pet_dataset(350)
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(pet_dataset)
+    pets = pet_shop.pets
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    threads = [
+        threading.Thread(target=lambda: [pet_shop.sell_pet(pet) for pet in pets])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sales = [
+        line
+        for line in mock_stdout.getvalue().splitlines()
+        if line.endswith("has found a new home.")
+    ]
+    assert len(sales) == len(pets), "Every pet should be sold exactly once"
+    assert len(set(sales)) == len(pets)
+    assert pet_shop.pets == []
+
+
+def test_persistent_pet_shop_writes_through(
+    mocker: MockerFixture, tmp_path: pathlib.Path
+) -> None:
+    path = str(tmp_path / "pets.db")
+    pet_shop = pet_inventory.PersistentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset, path
+    )
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.sell_pet(pet_shop_challenges.Dog(name="Buddy", age=3))
+    pet_shop.add_pet(pet_shop_challenges.Cat(name="Tom", age=2))
+    pet_shop.celebrate_birthday(pet_shop.find_pet_with_name("Fluffy"))
+    pet_shop.close()
+    assert mock_stdout.getvalue().splitlines() == [
+        "Buddy the dog has found a new home.",
+        "Tom the cat is now looking for a new home.",
+        "It's Fluffy's birthday.",
+    ]
+
+    reopened_pet_shop = pet_inventory.PersistentPetShop(path)
+    assert reopened_pet_shop.pets == [
+        pet_shop_challenges.Dog(name="Spot", age=5),
+        pet_shop_challenges.Cat(name="Fluffy", age=17),
+        pet_shop_challenges.Dog(name="Fido", age=9),
+        pet_shop_challenges.Animal(name="Nemo", age=1, species="fish"),
+        pet_shop_challenges.Cat(name="Ginger", age=8),
+        pet_shop_challenges.Animal(name="Floppy", age=2, species="rabbit"),
+        pet_shop_challenges.Cat(name="Tom", age=2),
+    ]
+    assert reopened_pet_shop.find_pets_of_species("cat") == [
+        pet_shop_challenges.Cat(name="Fluffy", age=17),
+        pet_shop_challenges.Cat(name="Ginger", age=8),
+        pet_shop_challenges.Cat(name="Tom", age=2),
+    ]
+    assert isinstance(
+        reopened_pet_shop.find_pet_with_name("Tom"), pet_shop_challenges.Cat
+    )
+    reopened_pet_shop.close()
+
+
+@pytest.mark.parametrize(
+    "pet, expected_message",
+    [
+        (
+            pet_shop_challenges.Cat(name="Ginger", age=9),
+            "Ginger the cat is not for sale in our shop.",
+        ),
+        (
+            pet_shop_challenges.Animal(name="Bubbles", age=1, species="fish"),
+            "Bubbles the fish is not for sale in our shop.",
+        ),
+    ],
+)
+def test_persistent_pet_shop_sell_pet_not_in_shop(
+    mocker: MockerFixture, pet: pet_shop_challenges.Animal, expected_message: str
+) -> None:
+    pet_shop = pet_inventory.PersistentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    pet_shop.sell_pet(pet)
+    assert mock_stdout.getvalue().splitlines() == [expected_message]
+    assert len(pet_shop.pets) == len(pet_shop_challenges.pet_dataset)
+    with pytest.raises(ValueError) as error:
+        pet_shop.find_pet_with_name("Bubbles")
+    assert str(error.value) == "No pets called Bubbles found in our shop."
+
+
+@pytest.mark.parametrize(
+    "pet_shop_class",
+    [
+        pet_shop_challenges.PetShop,
+        concurrent_pet_shop.ConcurrentPetShop,
+        pet_inventory.PersistentPetShop,
+    ],
+)
+@pytest.mark.parametrize(
+    "pet",
+    [
+        pet_shop_challenges.Animal(name="Bubbles", age=1, species="fish"),
+        pet_shop_challenges.Animal(name="Zed", age=1, species="lizard"),
+        pet_shop_challenges.Dog(name="Spot", age=6),
+    ],
+)
+def test_pet_shop_celebrate_birthday_of_pet_not_in_shop(
+    mocker: MockerFixture,
+    pet_shop_class: type[pet_shop_challenges.PetShop],
+    pet: pet_shop_challenges.Animal,
+) -> None:
+    pet_shop = pet_shop_class.from_pet_dataset(pet_shop_challenges.pet_dataset)
+    pets_before = sorted(map(repr, pet_shop.pets))
+    age = pet.age
+    stream = change_events.ChangeStream()
+    stream.attach()
+    subscription = stream.subscribe()
+    mock_stdout = mocker.patch("sys.stdout", new_callable=StringIO)
+    try:
+        with pytest.raises(ValueError) as error:
+            pet_shop.celebrate_birthday(pet)
+    finally:
+        stream.detach()
+    assert str(error.value) == f"No pets called {pet.name} found in our shop."
+    assert pet.age == age
+    assert mock_stdout.getvalue() == ""
+    assert subscription.poll() == []
+    assert sorted(map(repr, pet_shop.pets)) == pets_before
+    if isinstance(pet_shop, concurrent_pet_shop.ConcurrentPetShop):
+        assert "lizard" not in pet_shop.shards
+
+
+def test_change_stream_emits_mutations(mocker: MockerFixture) -> None:
+    stream = change_events.ChangeStream()
+    stream.attach()
+    subscription = stream.subscribe()
+    try:
+        bank_account = bank_challenges.BankAccount(
+            "12169553", "Alice Smith", 50, bank_challenges.TransactionJournal()
+        )
+        bank_account.deposit(30)
+        bank_account.withdraw(12)
+        bank_account.reverse_last_transaction()
+        pet_shop = pet_shop_challenges.PetShop.from_pet_dataset(
+            pet_shop_challenges.pet_dataset
+        )
+        mocker.patch("sys.stdout", new_callable=StringIO)
+        pet_shop.add_pet(pet_shop_challenges.Cat(name="Tom", age=2))
+        pet_shop.sell_pet(pet_shop_challenges.Dog(name="Spot", age=5))
+        pet_shop.sell_pet(pet_shop_challenges.Dog(name="Rex", age=4))
+        pet_shop.celebrate_birthday(pet_shop.find_pet_with_name("Nemo"))
+    finally:
+        stream.detach()
+    assert subscription.poll(max_events=2) == [
+        ("deposit", "12169553", 30),
+        ("withdraw", "12169553", -12),
+    ]
+    assert subscription.poll() == [
+        ("reverse_transaction", "12169553", 12),
+        ("add_pet", "Tom", 2, "cat"),
+        ("sell_pet", "Spot", 5, "dog"),
+        ("celebrate_birthday", "Nemo", 2, "fish"),
+    ]
+    assert subscription.poll() == []
+
+
+def test_change_stream_blocks_when_subscriber_falls_behind() -> None:
+    stream = change_events.ChangeStream(capacity=2)
+    subscription = stream.subscribe()
+    producer = threading.Thread(
+        target=lambda: [stream.emit(("deposit", "12169553", i)) for i in range(3)]
+    )
+    producer.start()
+    producer.join(timeout=0.1)
+    assert producer.is_alive(), "A full stream should block the producer"
+    assert subscription.poll() == [
+        ("deposit", "12169553", 0),
+        ("deposit", "12169553", 1),
+    ]
+    producer.join(timeout=5)
+    assert not producer.is_alive()
+    assert subscription.poll() == [("deposit", "12169553", 2)]
+
+
+def test_change_stream_disconnects_stalled_subscriber() -> None:
+    stream = change_events.ChangeStream(capacity=2, wait_seconds=0.01)
+    stalled = stream.subscribe()
+    active = stream.subscribe()
+    for i in range(2):
+        stream.emit(("deposit", "12169553", i))
+    assert active.poll() == [("deposit", "12169553", 0), ("deposit", "12169553", 1)]
+    stream.emit(("deposit", "12169553", 2))
+    assert stream.subscriptions == [active]
+    assert active.poll() == [("deposit", "12169553", 2)]
+    with pytest.raises(ValueError) as error:
+        stalled.poll()
+    assert (
+        str(error.value)
+        == "This subscription fell too far behind and was disconnected."
+    )
+    stalled.close()
+
+
+def test_change_stream_close_is_idempotent(tmp_path: pathlib.Path) -> None:
+    stream = change_events.ChangeStream(capacity=1, wait_seconds=0.01)
+    subscription = stream.subscribe()
+    subscription.close()
+    subscription.close()
+    sink = change_events.FileSink(stream, str(tmp_path / "changes.jsonl"))
+    stream.emit(("deposit", "12169553", 30))
+    stream.emit(("deposit", "12169553", 5))
+    assert sink.subscription.disconnected
+    sink.close()
+    sink.close()
+    assert stream.subscriptions == []
+
+
+def test_concurrent_pet_shop_emits_changes_under_shard_lock(
+    mocker: MockerFixture,
+) -> None:
+    pet_shop = concurrent_pet_shop.ConcurrentPetShop.from_pet_dataset(
+        pet_shop_challenges.pet_dataset
+    )
+    shard = pet_shop.shard("dog")
+    stream = change_events.ChangeStream()
+    emitted_under_lock = []
+    original_emit = stream.emit
+
+    def emit(event: change_events.ChangeEvent) -> None:
+        emitted_under_lock.append(shard.lock.locked())
+        original_emit(event)
+
+    mocker.patch.object(stream, "emit", side_effect=emit)
+    stream.attach()
+    subscription = stream.subscribe()
+    mocker.patch("sys.stdout", new_callable=StringIO)
+    try:
+        rex = pet_shop_challenges.Dog(name="Rex", age=4)
+        pet_shop.add_pet(rex)
+        pet_shop.celebrate_birthday(rex)
+        pet_shop.sell_pet(rex)
+        pet_shop.checkout(
+            pet_shop.reserve_pet(pet_shop_challenges.Dog(name="Spot", age=5))
+        )
+    finally:
+        stream.detach()
+    assert emitted_under_lock == [True, True, True, True]
+    assert subscription.poll() == [
+        ("add_pet", "Rex", 4, "dog"),
+        ("celebrate_birthday", "Rex", 5, "dog"),
+        ("sell_pet", "Rex", 5, "dog"),
+        ("sell_pet", "Spot", 5, "dog"),
+    ]
+
+
+def test_change_stream_file_sink_replay(tmp_path: pathlib.Path) -> None:
+    path = str(tmp_path / "changes.jsonl")
+    stream = change_events.ChangeStream()
+    sink = change_events.FileSink(stream, path)
+    stream.emit(("deposit", "12169553", 30))
+    assert sink.drain() == 1
+    stream.emit(("sell_pet", "Spot", 5, "dog"))
+    sink.close()
+    assert list(change_events.replay(path)) == [
+        ("deposit", "12169553", 30),
+        ("sell_pet", "Spot", 5, "dog"),
+    ]
+    assert stream.subscriptions == []
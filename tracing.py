@@ -0,0 +1,172 @@
+import builtins
+import functools
+import json
+import threading
+from array import array
+from time import perf_counter_ns
+from typing import Any, Callable
+
+import bank_challenges
+import concurrent_pet_shop
+import pet_inventory
+import pet_shop_challenges
+
+TRACE_CAPACITY = 65536
+
+TRACED_METHODS: list[tuple[type, str]] = [
+    (bank_challenges.ATM, "from_account_dataset"),
+    (bank_challenges.ATM, "menu"),
+    (bank_challenges.ATM, "serve_customer"),
+    (bank_challenges.ATM, "process_deposit"),
+    (bank_challenges.ATM, "process_withdrawal"),
+    (bank_challenges.ATM, "find_account"),
+    (bank_challenges.ATM, "parse_amount"),
+    (bank_challenges.ATM, "success_message"),
+    (bank_challenges.BankAccount, "deposit"),
+    (bank_challenges.BankAccount, "withdraw"),
+    (bank_challenges.TokenBucket, "try_consume"),
+    (pet_shop_challenges.PetShop, "from_pet_dataset"),
+    (pet_shop_challenges.PetShop, "find_pet_with_name"),
+    (pet_shop_challenges.PetShop, "add_pet"),
+    (pet_shop_challenges.PetShop, "sell_pet"),
+    (pet_shop_challenges.PetShop, "celebrate_birthday"),
+    (pet_shop_challenges.Animal, "celebrate_birthday"),
+    (concurrent_pet_shop.ConcurrentPetShop, "find_pet_with_name"),
+    (concurrent_pet_shop.ConcurrentPetShop, "add_pet"),
+    (concurrent_pet_shop.ConcurrentPetShop, "sell_pet"),
+    (concurrent_pet_shop.ConcurrentPetShop, "celebrate_birthday"),
+    (concurrent_pet_shop.ConcurrentPetShop, "reserve_pet"),
+    (concurrent_pet_shop.ConcurrentPetShop, "checkout"),
+    (pet_inventory.PersistentPetShop, "find_pet_with_name"),
+    (pet_inventory.PersistentPetShop, "find_pets_of_species"),
+    (pet_inventory.PersistentPetShop, "add_pet"),
+    (pet_inventory.PersistentPetShop, "sell_pet"),
+    (pet_inventory.PersistentPetShop, "celebrate_birthday"),
+]
+TRACED_MODULES = [bank_challenges, pet_shop_challenges]
+TRACED_BUILTINS = ["input", "print"]
+
+
+class Tracer:
+    def __init__(self, capacity: int = TRACE_CAPACITY):
+        self.capacity = capacity
+        self.names = [""] * capacity
+        self.starts = array("q", [0]) * capacity
+        self.durations = array("q", [0]) * capacity
+        self.thread_ids = array("Q", [0]) * capacity
+        self.span_count = 0
+        self.lock = threading.Lock()
+
+    def record(self, name: str, start: int, duration: int) -> None:
+        # Only reserving the slot needs the lock; threads then fill in their
+        # own slots without waiting for each other.
+        with self.lock:
+            slot = self.span_count % self.capacity
+            self.span_count += 1
+        self.names[slot] = name
+        self.starts[slot] = start
+        self.durations[slot] = duration
+        self.thread_ids[slot] = threading.get_ident()
+
+    def spans(self) -> list[tuple[str, int, int, int]]:
+        first = max(0, self.span_count - self.capacity)
+        return [
+            (
+                self.names[slot],
+                self.starts[slot],
+                self.durations[slot],
+                self.thread_ids[slot],
+            )
+            for slot in (i % self.capacity for i in range(first, self.span_count))
+        ]
+
+    def chrome_trace(self) -> dict[str, Any]:
+        return {
+            "traceEvents": [
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": start / 1000,
+                    "dur": duration / 1000,
+                    "pid": 0,
+                    "tid": thread_id,
+                }
+                for name, start, duration, thread_id in self.spans()
+            ],
+            "displayTimeUnit": "ns",
+        }
+
+    def dump_chrome_trace(self, path: str) -> None:
+        with open(path, "w") as trace_file:
+            json.dump(self.chrome_trace(), trace_file)
+
+
+def traced(name: str, function: Callable, tracer: Tracer) -> Callable:
+    @functools.wraps(function)
+    def traced_function(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            tracer.record(name, start, perf_counter_ns() - start)
+
+    return traced_function
+
+
+def traced_builtin(name: str, tracer: Tracer) -> Callable:
+    # Look the builtin up on every call so that anything patching builtins
+    # (such as tests mocking input) still takes effect while tracing.
+    def call_builtin(*args, **kwargs):
+        return getattr(builtins, name)(*args, **kwargs)
+
+    return traced(name, call_builtin, tracer)
+
+
+active_tracer: Tracer | None = None
+original_methods: dict[tuple[type, str], Any] = {}
+
+
+def enable_tracing(tracer: Tracer | None = None) -> Tracer:
+    # Tracing swaps traced wrappers into the classes and modules, and
+    # disable_tracing puts the originals back, so there is no cost at all
+    # while it is off.
+    global active_tracer
+    if active_tracer is not None:
+        disable_tracing()
+    active_tracer = Tracer() if tracer is None else tracer
+    for cls, name in TRACED_METHODS:
+        method = cls.__dict__[name]
+        original_methods[(cls, name)] = method
+        span_name = f"{cls.__name__}.{name}"
+        if isinstance(method, classmethod):
+            setattr(
+                cls,
+                name,
+                classmethod(traced(span_name, method.__func__, active_tracer)),
+            )
+        elif isinstance(method, staticmethod):
+            setattr(
+                cls,
+                name,
+                staticmethod(traced(span_name, method.__func__, active_tracer)),
+            )
+        else:
+            setattr(cls, name, traced(span_name, method, active_tracer))
+    for module in TRACED_MODULES:
+        for name in TRACED_BUILTINS:
+            setattr(module, name, traced_builtin(name, active_tracer))
+    return active_tracer
+
+
+def disable_tracing() -> Tracer | None:
+    global active_tracer
+    tracer = active_tracer
+    for (cls, name), method in original_methods.items():
+        setattr(cls, name, method)
+    original_methods.clear()
+    for module in TRACED_MODULES:
+        for name in TRACED_BUILTINS:
+            if name in vars(module):
+                delattr(module, name)
+    active_tracer = None
+    return tracer